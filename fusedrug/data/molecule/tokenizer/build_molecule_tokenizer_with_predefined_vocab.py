@@ -1,12 +1,19 @@
-from typing import Union, Optional
+from typing import Union, Optional, List
 from tokenizers.models import WordPiece
-from tokenizers import pre_tokenizers, normalizers, processors, Tokenizer
+from tokenizers import pre_tokenizers, normalizers, processors, Tokenizer, Encoding
 import json
+import os
+import functools
 from fusedrug.data.tokenizer.fast_tokenizer_learn import build_tokenizer
 from pytoda.proteins.processing import IUPAC_VOCAB, UNIREP_VOCAB
 
 import click
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # https://github.com/huggingface/tokenizers/issues/547
 # custom components: https://github.com/huggingface/tokenizers/blob/master/bindings/python/examples/custom_components.py
 
@@ -23,7 +30,8 @@ def build_molecule_tokenizer_with_predefined_vocab(
     Builds a simple tokenizer, without any learning aspect (so it doesn't require any iterations on a dataset)
 
     args:
-        vocab: if string then it is assumed to be a json file containing the vocabulary.
+        vocab: if string then it is assumed to be a json file containing the vocabulary,
+        or a newline separated (huggingface style) vocab file if it ends with ".txt" or ".vocab", in which case the token id is the line number.
         if it's dict it is assumed to be a python dictionary mapping from token string to token id.
         unknown_token:
         save_to_json_file:
@@ -33,14 +41,12 @@ def build_molecule_tokenizer_with_predefined_vocab(
     """
 
     if isinstance(vocab, str):
-        with open(vocab, "r") as f:
-            vocab = json.load(f)
+        # loading the vocab is the expensive part, so it is cached (per process) per vocab file
+        vocab = _load_vocab_file(vocab, os.path.getmtime(vocab))
     else:
         assert isinstance(vocab, dict)
-
-    assert unknown_token in vocab
-    # model = WordLevel(vocab=vocab, unk_token=unknown_token)
-    model = WordPiece(vocab=vocab, unk_token=unknown_token)
+    # a new model per call, since a Tokenizer shares (doesn't copy) its model
+    model = _build_wordpiece_model(vocab, unknown_token)
 
     tokenizer = build_tokenizer(
         model=model,
@@ -53,18 +59,67 @@ def build_molecule_tokenizer_with_predefined_vocab(
     return tokenizer
 
 
+@functools.lru_cache(maxsize=8)
+def _load_vocab_file(vocab_file: str, mtime: float) -> dict:
+    """
+    Cached (keyed on the vocab file path and modification time) loading of a vocab file.
+    Note that the returned vocab is shared between all the callers that hit the cache, so it should not be modified.
+    """
+    if vocab_file.endswith((".txt", ".vocab")):
+        # fast path - no json parsing
+        with open(vocab_file, "rb") as f:
+            # splitlines() also drops the "\r" of CRLF line endings
+            keys = f.read().splitlines()
+        vocab = {k.decode(): i for i, k in enumerate(keys) if k}
+    elif orjson is not None:
+        with open(vocab_file, "rb") as f:
+            vocab = orjson.loads(f.read())
+    else:
+        with open(vocab_file, "r") as f:
+            vocab = json.load(f)
+    return vocab
+
+
+def _build_wordpiece_model(vocab: dict, unknown_token: str) -> WordPiece:
+    assert unknown_token in vocab
+    # model = WordLevel(vocab=vocab, unk_token=unknown_token)
+    # NOTE: a trie based (LinMaxMatch) model would make encoding linear in the word length, but tokenizers only allows
+    #      custom python components for normalizers/pre_tokenizers/decoders (not models), and those can't be serialized anyway,
+    #      so we keep the native (rust) WordPiece model.
+    model = WordPiece(vocab=vocab, unk_token=unknown_token)
+    return model
+
+
+def tokenize_batch(
+    tokenizer: Tokenizer, texts: List[str], add_special_tokens: bool = True
+) -> List[Encoding]:
+    """
+    Encodes a batch of strings in a single call to the underlying (rust) tokenizer, which releases the GIL and
+    encodes the batch in parallel (the number of threads can be controlled with the RAYON_NUM_THREADS environment variable).
+    Prefer this over calling tokenizer.encode() in a python loop - callers that get one string at a time should
+    accumulate them into batches (>=64 strings is a good rule of thumb) to amortize the python->rust call overhead.
+
+    args:
+        tokenizer: a tokenizer, for example one returned by build_molecule_tokenizer_with_predefined_vocab()
+        texts: the strings to encode
+        add_special_tokens: whether the post processor should add the special tokens (same default as tokenizer.encode())
+    """
+    return tokenizer.encode_batch(texts, add_special_tokens=add_special_tokens)
+
+
 # Split(pattern='.', behavior='isolated').pre_tokenize_str('blah')
 
 # TODO delete function? located at: ./fusedrug/data/protein/tokenizer/build_protein_tokenizer_pair_encoding.py
-def _get_raw_vocab_dict(name: str) -> Union[IUPAC_VOCAB, UNIREP_VOCAB]:
-    if "iupac" == name:
-        return IUPAC_VOCAB
-    elif "unirep" == name:
-        return UNIREP_VOCAB
+_VOCAB_TABLE = {"iupac": IUPAC_VOCAB, "unirep": UNIREP_VOCAB}
 
-    raise Exception(
-        f"unfamiliar vocab name {name} - allowed options are 'iupac' or 'unirep'"
-    )
+
+def _get_raw_vocab_dict(name: str) -> Union[IUPAC_VOCAB, UNIREP_VOCAB]:
+    try:
+        return _VOCAB_TABLE[name]
+    except KeyError:
+        raise ValueError(
+            f"unfamiliar vocab name {name} - allowed options are {list(_VOCAB_TABLE)}"
+        ) from None
 
 
 # def _process_vocab_dict_def(token_str):
@@ -96,7 +151,7 @@ def main(
     """
     Builds a simple (not learned) vocabulary based tokenizer.
     Args:
-        INPUT_VOCAB_JSON_FILE: path to a json file mapping from token string to token id
+        INPUT_VOCAB_JSON_FILE: path to a json file mapping from token string to token id (or a newline separated .txt/.vocab file)
         OUTPUT_TOKENIZER_JSON_FILE: the tokenize will be serialized into this output file path. It can be then loaded using tokenizers.Tokenizer.from_file
     """
     print(f"input_vocab_json_file set to {input_vocab_json_file}")
@@ -3,22 +3,230 @@ from collections.abc import Iterable
 from tokenizers import Tokenizer, Encoding
 import tokenizers
 from warnings import warn
-from typing import Optional, List, Set, Union, Tuple, Any, Iterator
+from typing import Optional, List, Set, Union, Tuple, Any, Iterator, Callable
 import json
 import transformers
 import os
 from omegaconf import OmegaConf
 import collections
+import collections.abc
 import omegaconf
 import copy
 import traceback
 import re
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# fast json (de)serialization of the tokenizer jsons (which contain the entire vocab), falling back to json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# splits a sequence into sub-tokenizer type hints and the spans that follow them. A single negated character class, so matching is linear
+# (no backtracking), and it's compiled once rather than looked up in re's pattern cache on every call
+_TOKENIZER_TYPE_HINT_PATTERN = re.compile("<@TOKENIZER-TYPE=([^>]*)>")
+
+# the keys expected in special_tokens_dict. Note that special token IDs are assigned in the (deterministic) insertion order of special_tokens_dict,
+# not in this order - reordering them would change the IDs of tokenizers built from existing configs
+_CANONICAL_SPECIAL_KEYS = (
+    "bos_token",
+    "eos_token",
+    "unk_token",
+    "sep_token",
+    "pad_token",
+    "cls_token",
+    "mask_token",
+)
 
 TypedInput = collections.namedtuple(
     "TypedInput", ["input_type", "input_string", "max_len"]
 )
 
 
+def _parse_typed_inputs(sequence: str) -> List[TypedInput]:
+    """Splits a sequence with sub-tokenizer type hints (e.g. <@TOKENIZER-TYPE=AA>ACDE<@TOKENIZER-TYPE=SMILES>CCO) into a list of
+    TypedInput - one for each hint, holding the span of text that follows it.
+    """
+    matches = list(_TOKENIZER_TYPE_HINT_PATTERN.finditer(sequence))
+    assert (
+        len(matches) > 0 and not sequence[: matches[0].start()].strip()
+    ), f"Error: expecting leading modular tokenizer hints followed by a sequence to tokenize, got {sequence}"
+    span_ends = [m.start() for m in matches[1:]] + [len(sequence)]
+    return [
+        TypedInput(m.group(1), sequence[m.end() : span_end], None)
+        for m, span_end in zip(matches, span_ends)
+    ]
+
+
+def _json_loads(json_str: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(json_str)
+    return json.loads(json_str)
+
+
+def _json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        # orjson returns bytes, and Tokenizer.from_str() requires a str
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+# tokenizer jsons hold the entire vocab, so only a few (e.g. the sub-tokenizers of a single ModularTokenizer) are kept
+@functools.lru_cache(maxsize=4)
+def _load_json_cached(path: str, mtime: float, size: int) -> Dict:
+    """Parses a (tokenizer) json file. The result is cached, keyed on the path, modification time and size of the file.
+    Since the returned dict is shared between all the callers, use _load_tokenizer_json() to get an instance that may be modified.
+    """
+    with open(path, "rb") as f:
+        return _json_loads(f.read())
+
+
+def _load_tokenizer_json(path: str) -> Dict:
+    """Loads a tokenizer json file (using a cached parse of it).
+    The parts of the json that ModularTokenizer modifies in place (added_tokens and model.vocab) are copied, so the cached instance is never changed.
+    """
+    stat = os.stat(path)
+    t_json = copy.copy(_load_json_cached(path, stat.st_mtime, stat.st_size))
+    t_json["model"] = copy.copy(t_json["model"])
+    t_json["model"]["vocab"] = copy.copy(t_json["model"]["vocab"])
+    if t_json.get("added_tokens") is not None:
+        t_json["added_tokens"] = [dict(t) for t in t_json["added_tokens"]]
+    return t_json
+
+
+def _copy_cfg_list(cfg_list: List[Dict]) -> List[Dict]:
+    """A (much faster than deepcopy) copy of a tokenizers_info list - a list of small dicts of strings/ints, possibly holding (flat) dicts"""
+    return [
+        {k: (dict(v) if isinstance(v, dict) else v) for k, v in d.items()}
+        for d in cfg_list
+    ]
+
+
+# ModularTokenizer.decode() uses numpy for array inputs of at least this many IDs
+_DECODE_VECTORIZED_MIN_LEN = 512
+
+
+def _map_in_threads(func: Callable[[Any], Any], items: List) -> List:
+    """Applies func to each of items, in parallel threads - for per sub-tokenizer work (json loading and Tokenizer construction, which run in rust/C).
+    The threads only live for the duration of the call, and a single item is processed in the calling thread.
+    """
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), os.cpu_count() or 1)) as pool:
+        return list(pool.map(func, items))
+
+
+class SubTokenizerInfo:
+    """Information on a single sub-tokenizer of a ModularTokenizer (the values of ModularTokenizer.tokenizers_info).
+    Uses __slots__ for fast attribute access. Also supports the dict-style access (t_info["max_len"], "max_len" in t_info, t_info.get(...))
+    of the dicts it replaces. As with a dict, a key is "in" it once it was set (at construction, or later), whatever its value.
+    Keys other than the fields below are kept in extra.
+    """
+
+    __slots__ = (
+        "name",
+        "tokenizer_id",
+        "json_path",
+        "modular_json_path",
+        "max_len",
+        "json_instance",
+        "tokenizer_inst",
+        "extra",
+        "_set_fields",
+    )
+    _FIELDS = frozenset(__slots__) - {"extra", "_set_fields"}
+
+    name: str
+    tokenizer_id: Optional[int]
+    json_path: Optional[str]
+    modular_json_path: Optional[str]
+    max_len: Optional[int]
+    json_instance: Optional[Dict]
+    tokenizer_inst: Optional[Tokenizer]
+    extra: Dict[str, Any]
+    _set_fields: Set[str]
+
+    def __init__(self, name: str, **kwargs: Any) -> None:
+        # fields that were never set are None (but not "in" self)
+        object.__setattr__(self, "_set_fields", set())
+        for field in self._FIELDS:
+            object.__setattr__(self, field, None)
+        object.__setattr__(self, "extra", {})
+        self.name = name
+        for key, val in kwargs.items():
+            self[key] = val
+
+    def __setattr__(self, key: str, val: Any) -> None:
+        object.__setattr__(self, key, val)
+        if key in self._FIELDS:
+            self._set_fields.add(key)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = {key: getattr(self, key) for key in self.__slots__}
+        # so that setting a field of a (shallow) copy doesn't make it "in" the original
+        state["_set_fields"] = set(self._set_fields)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # (copy and pickle) restores the state as is, bypassing __setattr__
+        for key, val in state.items():
+            object.__setattr__(self, key, val)
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SubTokenizerInfo":
+        return cls(**d)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, val: Any) -> None:
+        if key in self._FIELDS:
+            setattr(self, key, val)
+        else:
+            self.extra[key] = val
+
+    def __contains__(self, key: str) -> bool:
+        if key in self._FIELDS:
+            return key in self._set_fields
+        return key in self.extra
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+
+class _DecoderDictView(collections.abc.Mapping):
+    """A read-only view of ModularTokenizer's ID-indexed decoder arrays, with the interface of the (former) decoder_dict:
+    {id: {"token": token, "is_special": bool}}. The per-ID dicts are constructed on access.
+    """
+
+    def __init__(
+        self,
+        id_to_token: List[Optional[str]],
+        id_to_is_special: np.ndarray,
+        num_mapped: int,
+    ) -> None:
+        self._id_to_token = id_to_token
+        self._id_to_is_special = id_to_is_special
+        self._num_mapped = num_mapped
+
+    def __getitem__(self, id: int) -> Dict:
+        if 0 <= id < len(self._id_to_token):
+            token = self._id_to_token[id]
+            if token is not None:
+                return {"token": token, "is_special": bool(self._id_to_is_special[id])}
+        raise KeyError(id)
+
+    def __iter__(self) -> Iterator[int]:
+        return (id for id, token in enumerate(self._id_to_token) if token is not None)
+
+    def __len__(self) -> int:
+        return self._num_mapped
+
+
 class ModularTokenizer(transformers.PreTrainedTokenizerFast):
     def __init__(
         self,
@@ -28,6 +236,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         additional_tokens_list: Optional[List] = None,
         max_possible_token_id: Optional[int] = None,
         max_special_token_id: Optional[int] = None,
+        validate: Optional[bool] = None,
         **kwargs: Any,
     ) -> None:
         """Creates a modular tokenizer that combines multiple existing tokenizers, adjusting them so that:
@@ -59,6 +268,9 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                 If max_special_token_id is set, when special tokens are added, they are mapped to IDs between 0 and max_special_token_id
                 (after which come regular token IDs). Once max_special_token_id is reached, no more special tokens may be added.
                 If it is not set, new special tokens may be mapped to IDs higher that regular token IDs. If Defaults to None (i.e. no limit is set).
+            validate (Optional[bool], optional): Whether to run diagnose() on the resulting tokenizer and assert that it is consistent.
+                Defaults to None, i.e. validate only when building from non-modular jsons (modular jsons were already validated when they were created).
+                Validation can also be disabled by setting the environment variable MODULAR_TOKENIZER_SKIP_DIAGNOSE=1
         """
         # ModularTokenizer inherits the interface of PreTrainedTokenizerBase, but not the underlying logic, therefore super.__init__() is not called
 
@@ -71,11 +283,25 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             tokenizers_info_list = tokenizers_info
         else:
             raise Exception("unexpected tokenizers_info type")
-        self.tokenizers_info_raw_cfg = copy.deepcopy(tokenizers_info_list)
+        self.tokenizers_info_raw_cfg = _copy_cfg_list(tokenizers_info_list)
         self.tokenizers_info = ModularTokenizer.cfg_list_2_dict(
-            copy.deepcopy(tokenizers_info_list)
+            _copy_cfg_list(tokenizers_info_list)
         )
         self.special_tokens_dict = special_tokens_dict
+        if special_tokens_dict is not None:
+            unknown_keys = [
+                k for k in special_tokens_dict if k not in _CANONICAL_SPECIAL_KEYS
+            ]
+            if len(unknown_keys) > 0:
+                warn(
+                    f"special_tokens_dict contains keys {unknown_keys} which are not among the expected keys {list(_CANONICAL_SPECIAL_KEYS)}"
+                )
+        # the values of special_tokens_dict, materialized once (a list, since Tokenizer.add_special_tokens() requires one)
+        self._special_tokens_values: Optional[List[str]] = (
+            list(special_tokens_dict.values())
+            if special_tokens_dict is not None
+            else None
+        )
         self._max_possible_token_id = max_possible_token_id
         self._max_special_token_id = max_special_token_id
 
@@ -85,24 +311,24 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             if self.special_tokens_dict is None:
                 all_special_tokens = list([])
             else:
-                all_special_tokens = list(self.special_tokens_dict.values())
+                all_special_tokens = list(self._special_tokens_values)
             if additional_tokens_list is not None:
                 all_special_tokens += additional_tokens_list
+            # a companion set for fast membership tests (the list keeps the order)
+            all_special_tokens_set = set(all_special_tokens)
 
-            # collect all special tokens (without indices):
+            # load the jsons (in parallel), then collect all special tokens (without indices):
+            self._load_json_instances(path_key="json_path")
             for t_type in self.tokenizers_info:
-                t_info = self.tokenizers_info[t_type]
-                t_json = json.load(open(t_info["json_path"]))
-                self.tokenizers_info[t_type]["json_instance"] = t_json
-
+                t_json = self.tokenizers_info[t_type].json_instance
                 part_special_tokens = ModularTokenizer.get_subtokenizer_added_tokens(
                     t_json,
                     enforce_special=False,
                 )
-                part_special_tokens = [
-                    t for t in part_special_tokens if t not in all_special_tokens
-                ]
-                all_special_tokens = all_special_tokens + part_special_tokens
+                for t in part_special_tokens:
+                    if t not in all_special_tokens_set:
+                        all_special_tokens_set.add(t)
+                        all_special_tokens.append(t)
 
             all_special_token_structs = ModularTokenizer.build_special_token_list(
                 all_special_tokens
@@ -125,46 +351,48 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                 raise Exception(
                     "when loading a tokenizer additional_tokens_list must be None. Use ModularTokenizer.add_special_tokens instead"
                 )
+            self._load_json_instances(path_key="modular_json_path")
+
+        # rearrange regular token indices to map to IDs starting from next_index.
+        # The starting index of each sub-tokenizer is computed up front (from the number of its regular tokens),
+        # so that the sub-tokenizers can then be remapped and instantiated independently (in parallel).
+        starting_indices: Dict[str, int] = {}
+        if not load_adjusted_jsons:
+            special_tokens_set = {t["content"] for t in all_special_token_structs}
             for t_type in self.tokenizers_info:
-                t_info = self.tokenizers_info[t_type]
-                t_json = json.load(open(t_info["modular_json_path"]))
-                self.tokenizers_info[t_type]["json_instance"] = t_json
+                starting_indices[t_type] = next_index
+                next_index += len(
+                    self.tokenizers_info[t_type].json_instance["model"]["vocab"].keys()
+                    - special_tokens_set
+                )
 
-        # rearrange regular token indices to map to IDs starting from next_index:
-        for t_type in self.tokenizers_info:
+        def _build_sub_tokenizer(t_type: str) -> Tuple[Dict, Tokenizer]:
             t_info = self.tokenizers_info[t_type]
-            t_json = self.tokenizers_info[t_type]["json_instance"]
+            t_json = t_info.json_instance
             # operations on the tokenizer json
             if not load_adjusted_jsons:
-                t_json["added_tokens"] = all_special_token_structs
-                (t_json["model"]["vocab"], next_index,) = ModularTokenizer.remap_vocab(
+                # a copy per sub-tokenizer, since added_tokens may later be extended in place
+                t_json["added_tokens"] = list(all_special_token_structs)
+                (t_json["model"]["vocab"], _) = ModularTokenizer.remap_vocab(
                     vocab=t_json["model"]["vocab"],
                     special_token_structs=all_special_token_structs,
-                    starting_index=next_index,
+                    starting_index=starting_indices[t_type],
                 )
             # end operations on json
-            # operations on the tokenizer instance (if possible, operations should be done here, using built-in tokenizer methods)
-            json_str = json.dumps(t_json)
-            tokenizer_inst = Tokenizer.from_str(json_str)
-            if self.special_tokens_dict is not None:
-                # At this point, tokens from self.special_tokens_dict are in every tokenizer. This is only to test that all special tokens were added.
-                num_add = tokenizer_inst.add_special_tokens(
-                    list(self.special_tokens_dict.values())
-                )
-                if num_add > 0:
-                    raise Exception(
-                        f"All special tokens should have been in the vocabulary at this point. {num_add} were added - need to check why."
-                    )
-            if "max_len" in t_info and t_info["max_len"] is not None:
-                max_size = t_info["max_len"]
-                tokenizer_inst.enable_truncation(
-                    max_length=max_size,
-                    direction="right",
-                )
-            json_str = tokenizer_inst.to_str()
-            t_json = json.loads(json_str)
-            self.tokenizers_info[t_type]["tokenizer_inst"] = tokenizer_inst
-            self.tokenizers_info[t_type]["json_instance"] = t_json
+            tokenizer_inst = self._build_tokenizer_inst(
+                t_type=t_type,
+                t_json=t_json,
+                special_tokens_values=self._special_tokens_values,
+            )
+            # t_json already holds all the changes made to the tokenizer (remapped vocab, added tokens and truncation), so there is no need
+            # to serialize tokenizer_inst and parse it back
+            return t_json, tokenizer_inst
+
+        t_types = list(self.tokenizers_info.keys())
+        sub_tokenizers = _map_in_threads(_build_sub_tokenizer, t_types)
+        for t_type, (t_json, tokenizer_inst) in zip(t_types, sub_tokenizers):
+            self.tokenizers_info[t_type].tokenizer_inst = tokenizer_inst
+            self.tokenizers_info[t_type].json_instance = t_json
 
         self.max_len: Union[
             int, None
@@ -173,9 +401,19 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
 
         self._pad_token_type_id = 0
         self._pad_token: Union[str, None] = None
-
-        test_res, test_res_detail = self.diagnose()
-        assert False not in test_res.values(), "resulting tokenizer is not consistent"
+        # token -> ID, memoized results of token_to_id(token) without t_type (cleared whenever the vocabulary changes).
+        # Only tokens found in the vocabulary are cached, so its size is bounded by the vocabulary size
+        self._token_to_id_cache: Dict[str, int] = {}
+
+        if validate is None:
+            validate = not load_adjusted_jsons
+        if os.environ.get("MODULAR_TOKENIZER_SKIP_DIAGNOSE", "0") == "1":
+            validate = False
+        if validate:
+            test_res, test_res_detail = self.diagnose()
+            assert (
+                False not in test_res.values()
+            ), "resulting tokenizer is not consistent"
         self.build_inner_decoder()
         if self._max_possible_token_id is not None:
             if self._get_max_mapped_id() > self._max_possible_token_id:
@@ -183,6 +421,52 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                     f"tokenizer remapping resulted in IDs greater (max_id={self._get_max_mapped_id()}) than max_possible_id ({self._max_possible_token_id}). Reinitialize the modular tokenizer with larger max_possible_id"
                 )
 
+    def _build_tokenizer_inst(
+        self, t_type: str, t_json: Dict, special_tokens_values: Optional[List]
+    ) -> Tokenizer:
+        """Builds the tokenizer instance of sub-tokenizer t_type from its (adjusted) json, and applies to it the settings that are not kept in the json.
+        These settings (truncation) are also patched into t_json, so it keeps matching the tokenizer instance.
+        Safe to call concurrently for different sub-tokenizers.
+        """
+        # operations on the tokenizer instance (if possible, operations should be done here, using built-in tokenizer methods)
+        tokenizer_inst = Tokenizer.from_str(_json_dumps(t_json))
+        if special_tokens_values is not None:
+            # At this point, tokens from self.special_tokens_dict are in every tokenizer. This is only to test that all special tokens were added.
+            num_add = tokenizer_inst.add_special_tokens(special_tokens_values)
+            if num_add > 0:
+                raise Exception(
+                    f"All special tokens should have been in the vocabulary at this point. {num_add} were added - need to check why."
+                )
+        # (re)apply truncation, unless the json (e.g. one saved by this class) already holds it
+        max_size = self.tokenizers_info[t_type].max_len
+        if max_size is not None:
+            # the serialized form of the truncation setting (as in tokenizer_inst.to_str())
+            truncation = {
+                "direction": "Right",
+                "max_length": max_size,
+                "strategy": "LongestFirst",
+                "stride": 0,
+            }
+            if t_json.get("truncation") != truncation:
+                tokenizer_inst.enable_truncation(
+                    max_length=max_size,
+                    direction="right",
+                )
+                t_json["truncation"] = truncation
+        return tokenizer_inst
+
+    def _load_json_instances(self, path_key: str) -> None:
+        """Loads (in parallel, since it is mostly I/O and json parsing) the json of every sub-tokenizer from the path stored under path_key
+        in its tokenizers_info entry, and stores it as its json_instance.
+        """
+        t_types = list(self.tokenizers_info.keys())
+        t_jsons = _map_in_threads(
+            _load_tokenizer_json,
+            [getattr(self.tokenizers_info[t_type], path_key) for t_type in t_types],
+        )
+        for t_type, t_json in zip(t_types, t_jsons):
+            self.tokenizers_info[t_type].json_instance = t_json
+
     @staticmethod
     def remap_vocab(
         vocab: Dict,
@@ -217,20 +501,26 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
 
         # At this point the vocab we're building contains all the special tokens with their IDs, and we know from which ID to start the regular token mappings
         # First, remove any tokens that are special from the input vocabulary, so that if any are present there as regular tokens, they won't be duplicated
-        regular_tokens = (
-            set(vocab.keys()) - special_tokens
-        )  # TODO: make this an ordered operation, to make sure we have a consistent mapping
-        # (maybe order the regular tokens in an alphabetic order)
-        regular_vocab = {
-            r_t: vocab[r_t] for r_t in regular_tokens
-        }  # These are only regular tokens with their original indices
-        regular_sorted = sorted(
-            regular_vocab.items(), key=lambda x: x[1], reverse=False
-        )  # regular tokens sorted by their ID in ascending order.
-
-        regular_vocab = {t[0]: i + starting_index for i, t in enumerate(regular_sorted)}
-        init_vocab.update(regular_vocab)
-        starting_index_new = max(regular_vocab.values()) + 1
+        # Tokenizer vocabs are (almost always) stored in ID order, so a single ordered pass is enough.
+        # The order is verified along the way, and we fall back to sorting by ID if it doesn't hold.
+        regular_tokens = []
+        prev_id = None
+        is_sorted = True
+        for token, token_id in vocab.items():
+            if token in special_tokens:
+                continue
+            if prev_id is not None and token_id < prev_id:
+                is_sorted = False
+            prev_id = token_id
+            regular_tokens.append(token)
+        if not is_sorted:
+            # regular tokens sorted by their ID in ascending order (stable, so the mapping is consistent)
+            regular_tokens.sort(key=vocab.__getitem__)
+
+        starting_index_new = starting_index + len(regular_tokens)
+        init_vocab.update(
+            zip(regular_tokens, range(starting_index, starting_index_new))
+        )
         return init_vocab, starting_index_new
 
     @staticmethod
@@ -348,8 +638,8 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         special_tokens = ModularTokenizer.get_subtokenizer_added_tokens(
             tokenizer_json_inst=tokenizer_json_inst, enforce_special=enforce_special
         )
-        all_tokens = set(tokenizer_json_inst["model"]["vocab"].keys())
-        return all_tokens - set(special_tokens)
+        # set operations on the keys view, without materializing a set of the entire vocab first
+        return tokenizer_json_inst["model"]["vocab"].keys() - frozenset(special_tokens)
 
     @staticmethod
     def get_subtokenizer_vocab(
@@ -464,6 +754,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         id2token: Dict[int, Dict], add_vocab: Dict, is_special: Optional[bool] = False
     ) -> Dict[int, Dict]:
         """Updates id2token mapping with tokens from add_vocab. Returns the updated id2token
+        (no longer used by ModularTokenizer itself, whose decoder is kept in ID-indexed arrays - see build_inner_decoder())
 
         Args:
             id2token (Dict): A dictionary of int:{
@@ -477,14 +768,14 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             Dict: _description_
         """
 
-        for token in add_vocab:
-            if add_vocab[token] in id2token:
+        for token, token_id in add_vocab.items():
+            # the first token to claim an ID keeps it
+            if token_id in id2token:
                 print(
-                    "Warning: ID collision during update_id2token_mapping for token {token}, id {add_vocab[token]}"
+                    f"Warning: ID collision during update_id2token_mapping for token {token}, id {token_id}"
                 )
             else:
-                tmp_dict = {"token": token, "is_special": is_special}
-                id2token[add_vocab[token]] = tmp_dict
+                id2token[token_id] = {"token": token, "is_special": is_special}
         return id2token
 
     def build_inner_decoder(self) -> None:
@@ -506,36 +797,76 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             Cons:
             -   not as efficient as built-in tokenizer decode.
 
+        The mapping is stored in two flat (ID-indexed) arrays - self._id_to_token (a list of tokens, None for unmapped IDs) and
+        self._id_to_is_special (a numpy bool array), and self.decoder_dict is a read-only, dict-like view of them.
         """
-        self.decoder_dict: Dict = {}
+        t_jsons = []
         for t_type in self.tokenizers_info:
             t_info = self.tokenizers_info[t_type]
             assert (
-                "json_instance" in t_info
+                t_info.json_instance is not None
             ), f"tokenizer of type {t_type} hasn't been instantiated yet. Call init first."
-            if len(self.decoder_dict) == 0:  # Add
-                sp_tokens = ModularTokenizer.get_subtokenizer_added_tokens(
-                    t_info["json_instance"]
-                )
-                sp_vocab = ModularTokenizer.get_subtokenizer_vocab(
-                    tokenizer_json_inst=t_info["json_instance"], token_list=sp_tokens
-                )
-                self.decoder_dict = ModularTokenizer.update_id2token_mapping(
-                    id2token=self.decoder_dict, add_vocab=sp_vocab, is_special=True
-                )
-            reg_tokens = ModularTokenizer.get_subtokenizer_regular_tokens(
-                t_info["json_instance"]
-            )
-            reg_vocab = ModularTokenizer.get_subtokenizer_vocab(
-                tokenizer_json_inst=t_info["json_instance"], token_list=list(reg_tokens)
+            t_jsons.append(t_info.json_instance)
+        max_id = max(
+            [max(t_json["model"]["vocab"].values(), default=-1) for t_json in t_jsons],
+            default=-1,
+        )
+        id_to_token: List[Optional[str]] = [None] * (max_id + 1)
+        id_to_is_special = np.zeros(max_id + 1, dtype=bool)
+        num_mapped = 0
+        collisions = []
+        sp_vocab: Dict[str, int] = {}
+        if len(t_jsons) > 0:
+            # special tokens are common to all the sub-tokenizers, so they're taken from the first one
+            sp_vocab = ModularTokenizer.get_subtokenizer_vocab(
+                tokenizer_json_inst=t_jsons[0],
+                token_list=ModularTokenizer.get_subtokenizer_added_tokens(t_jsons[0]),
             )
-            self.decoder_dict = ModularTokenizer.update_id2token_mapping(
-                id2token=self.decoder_dict, add_vocab=reg_vocab, is_special=False
+            for token, token_id in sp_vocab.items():
+                if id_to_token[token_id] is not None:
+                    collisions.append(token_id)
+                    continue
+                id_to_token[token_id] = token
+                id_to_is_special[token_id] = True
+                num_mapped += 1
+        # regular tokens of all the sub-tokenizers
+        for t_json in t_jsons:
+            sp_tokens_set = set(ModularTokenizer.get_subtokenizer_added_tokens(t_json))
+            for token, token_id in t_json["model"]["vocab"].items():
+                if token in sp_tokens_set:
+                    continue
+                if id_to_token[token_id] is not None:
+                    collisions.append(token_id)
+                    continue
+                id_to_token[token_id] = token
+                num_mapped += 1
+        if collisions:
+            # IDs that were already mapped keep their first token
+            warn(
+                f"Warning: ID collision during build_inner_decoder for {len(collisions)} IDs: {collisions[:10]}"
             )
-
-    def diagnose(self) -> Tuple[Dict, Dict]:
+        self._id_to_token = id_to_token
+        self._id_to_is_special = id_to_is_special
+        # numpy versions of the above, for vectorized decoding
+        self._id_to_token_array = np.array(id_to_token, dtype=object)
+        self._id_is_mapped = np.fromiter(
+            (t is not None for t in id_to_token), dtype=bool, count=len(id_to_token)
+        )
+        self._num_mapped_ids = num_mapped
+        # the added (special) tokens vocab, as returned by get_added_vocab()
+        self._added_vocab = sp_vocab
+        # all the mapped tokens, for membership tests (e.g. in add_special_tokens)
+        self._token_name_set = set(id_to_token)
+        self._token_name_set.discard(None)
+        self.decoder_dict = _DecoderDictView(id_to_token, id_to_is_special, num_mapped)
+
+    def diagnose(self, fast_fail: bool = False) -> Tuple[Dict, Dict]:
         """_summary_
 
+        Args:
+            fast_fail (bool, optional): if True, return as soon as the first failure is found (the remaining tests are
+                not run, and are reported as passed). Defaults to False.
+
         Returns:
             Tuple[Dict, Dict]: brief (pass/fail for each test) and detailed (which tokenizers failed) description of failed tests
         """
@@ -549,69 +880,71 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         tokenizer_types = list(self.tokenizers_info.keys())
         # TODO: If there are multiple tokenizer files that were derived from the same file - use only one for diagnosis
         all_inds_set: Set[int] = set()
-        all_inds_len = 0
         if len(tokenizer_types) > 1:
-            special_tokens = list(
-                ModularTokenizer.get_subtokenizer_added_tokens(
-                    self.tokenizers_info[tokenizer_types[0]]["json_instance"]
-                )
-            )
-            special_tokens_vocab = ModularTokenizer.get_subtokenizer_vocab(
-                tokenizer_json_inst=self.tokenizers_info[tokenizer_types[0]][
-                    "json_instance"
-                ],
-                token_list=special_tokens,
-            )
-
-            # check if all special tokens are the same across all tokenizers
-            for t_type in tokenizer_types:
-                special_tokens_t = list(
+            # the special tokens (and their vocab) of each tokenizer are computed once, and reused by all the tests
+            special_tokens_per_type = {
+                t_type: set(
                     ModularTokenizer.get_subtokenizer_added_tokens(
-                        self.tokenizers_info[t_type]["json_instance"]
+                        self.tokenizers_info[t_type].json_instance
                     )
                 )
-                special_tokens_vocab_t = ModularTokenizer.get_subtokenizer_vocab(
-                    tokenizer_json_inst=self.tokenizers_info[t_type]["json_instance"],
-                    token_list=special_tokens_t,
+                for t_type in tokenizer_types
+            }
+            special_tokens_vocab_per_type = {
+                t_type: ModularTokenizer.get_subtokenizer_vocab(
+                    tokenizer_json_inst=self.tokenizers_info[t_type].json_instance,
+                    token_list=list(special_tokens_per_type[t_type]),
                 )
+                for t_type in tokenizer_types
+            }
+            special_tokens_vocab = special_tokens_vocab_per_type[tokenizer_types[0]]
 
-                if special_tokens_vocab != special_tokens_vocab_t:
+            # check if all special tokens are the same across all tokenizers
+            for t_type in tokenizer_types:
+                if special_tokens_vocab != special_tokens_vocab_per_type[t_type]:
                     result["special token consistency"] = False
                     result_details["special token consistency"].append(t_type)
+                    if fast_fail:
+                        return result, result_details
 
             # check if there are no ID collisions within/between vocabs
             for t_type in tokenizer_types:
-                regular_tokens = list(
-                    ModularTokenizer.get_subtokenizer_regular_tokens(
-                        self.tokenizers_info[t_type]["json_instance"]
-                    )
-                )
-                regular_tokens_vocab = ModularTokenizer.get_subtokenizer_vocab(
-                    tokenizer_json_inst=self.tokenizers_info[t_type]["json_instance"],
-                    token_list=regular_tokens,
-                )
-                regular_tokens_IDs = regular_tokens_vocab.values()
+                special_tokens_t = special_tokens_per_type[t_type]
+                regular_tokens_IDs = [
+                    token_id
+                    for token, token_id in self.tokenizers_info[t_type]
+                    .json_instance["model"]["vocab"]
+                    .items()
+                    if token not in special_tokens_t
+                ]
                 regular_tokens_ID_set = set(regular_tokens_IDs)
                 if len(regular_tokens_IDs) != len(regular_tokens_ID_set):
                     result["ID duplicates in vocab"] = False
                     result_details["ID duplicates in vocab"].append(t_type)
+                    if fast_fail:
+                        return result, result_details
 
-                all_inds_set = all_inds_set.union(regular_tokens_ID_set)
-                if len(all_inds_set) != all_inds_len + len(regular_tokens_ID_set):
+                # in-place union - the size grows by less than the number of new IDs only if some of them were already there
+                prev_len = len(all_inds_set)
+                all_inds_set |= regular_tokens_ID_set
+                if len(all_inds_set) - prev_len != len(regular_tokens_ID_set):
                     result["ID collisions across vocabs"] = False
                     result_details["ID collisions across vocabs"].append(t_type)
-                all_inds_len = len(all_inds_set)
+                    if fast_fail:
+                        return result, result_details
 
             special_tokens_ID_set = set(special_tokens_vocab.values())
-            if len(special_tokens_vocab.values()) != len(special_tokens_ID_set):
+            if len(special_tokens_vocab) != len(special_tokens_ID_set):
                 result["ID duplicates in vocab"] = False
                 result_details["ID duplicates in vocab"].append("special")
+                if fast_fail:
+                    return result, result_details
 
-            all_inds_set = all_inds_set.union(special_tokens_ID_set)
-            if len(all_inds_set) != all_inds_len + len(set(special_tokens_ID_set)):
+            prev_len = len(all_inds_set)
+            all_inds_set |= special_tokens_ID_set
+            if len(all_inds_set) - prev_len != len(special_tokens_ID_set):
                 result["ID collisions across vocabs"] = False
                 result_details["ID collisions across vocabs"].append("special")
-            all_inds_len = len(all_inds_set)
 
         return result, result_details
 
@@ -623,12 +956,12 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         Returns:
             bool: True is the tokenizer is consistent, False otherwise
         """
-        test_res, test_res_detail = self.diagnose()
+        test_res, test_res_detail = self.diagnose(fast_fail=True)
         return False not in test_res.values()
 
     @staticmethod
-    def cfg_list_2_dict(dict_list: List) -> Dict[str, Any]:
-        """Receives a list of dicts, each containing a key "name" and changes it to
+    def cfg_list_2_dict(dict_list: List) -> Dict[str, "SubTokenizerInfo"]:
+        """Receives a list of dicts, each containing a key "name" and changes it to a dict of SubTokenizerInfo, keyed by name
 
         Args:
             dict_list (List): _description_
@@ -636,7 +969,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         Returns:
             Dict[str, Any]: _description_
         """
-        return {d["name"]: d for d in dict_list}
+        return {d["name"]: SubTokenizerInfo.from_dict(d) for d in dict_list}
 
     def save_jsons(self, tokenizers_info: Optional[List] = None) -> None:
         """_summary_
@@ -655,20 +988,28 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             TODO: also save the config yaml there
         """
         if tokenizers_info is None:
-            for t_type in self.tokenizers_info:
-                tokenizer_inst = self.tokenizers_info[t_type]["tokenizer_inst"]
-                out_path = self.tokenizers_info[t_type]["modular_json_path"]
-                if not os.path.exists(os.path.dirname(out_path)):
-                    os.makedirs(os.path.dirname(out_path))
-                tokenizer_inst.save(out_path)
+            modular_json_paths = {
+                t_type: self.tokenizers_info[t_type].modular_json_path
+                for t_type in self.tokenizers_info
+            }
         else:
             tokenizers_info_dict = ModularTokenizer.cfg_list_2_dict(tokenizers_info)
-            for t_type in tokenizers_info_dict:
-                tokenizer_inst = self.tokenizers_info[t_type]["tokenizer_inst"]
-                out_path = tokenizers_info_dict[t_type]["modular_json_path"]
-                if not os.path.exists(os.path.dirname(out_path)):
-                    os.makedirs(os.path.dirname(out_path))
-                tokenizer_inst.save(out_path)
+            modular_json_paths = {
+                t_type: tokenizers_info_dict[t_type].modular_json_path
+                for t_type in tokenizers_info_dict
+            }
+        out_paths: Dict[str, str] = {}
+        for t_type, out_path in modular_json_paths.items():
+            if out_path is None:
+                raise Exception(
+                    f"Couldn't find modular_json_path for subtokenizer {t_type}"
+                )
+            out_paths[t_type] = out_path
+        # create each output directory once
+        for out_dir in {os.path.dirname(out_path) for out_path in out_paths.values()}:
+            os.makedirs(out_dir or ".", exist_ok=True)
+        for t_type, out_path in out_paths.items():
+            self.tokenizers_info[t_type].tokenizer_inst.save(out_path)
 
     def save(self, path: str) -> None:
         """Saves all information needed to reconstruct the modular tokenizer to path.
@@ -697,24 +1038,17 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                 return os.path.join("./", fname)
             return os.path.join(base_path, fname)
 
-        def set_field(tokenizers_info_cfg: List, name: str, key: str, val: Any) -> List:
-            for i, t in enumerate(tokenizers_info_cfg):
-                if t["name"] == name:
-                    t[key] = val
-                    tokenizers_info_cfg[i] = t
-                    return tokenizers_info_cfg
-            raise Exception(f"name {name} not found")
-
         tokenizers_info_cfg = self.tokenizers_info_raw_cfg
+        # the dicts in tokenizers_info_cfg, by name (updating them updates tokenizers_info_cfg)
+        tokenizers_info_cfg_by_name = {t["name"]: t for t in tokenizers_info_cfg}
 
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
         for t_type in self.tokenizers_info:
-            tokenizer_inst = self.tokenizers_info[t_type]["tokenizer_inst"]
-            if self.tokenizers_info[t_type]["json_path"] is not None:
-                input_json_path = self.tokenizers_info[t_type]["json_path"]
-            elif self.tokenizers_info[t_type]["modular_json_path"] is not None:
-                input_json_path = self.tokenizers_info[t_type]["modular_json_path"]
+            tokenizer_inst = self.tokenizers_info[t_type].tokenizer_inst
+            if self.tokenizers_info[t_type].json_path is not None:
+                input_json_path = self.tokenizers_info[t_type].json_path
+            elif self.tokenizers_info[t_type].modular_json_path is not None:
+                input_json_path = self.tokenizers_info[t_type].modular_json_path
             else:
                 raise Exception(f"Couldn't find json path for subtokenizer {t_type}")
             write_out_path = get_out_path(
@@ -727,20 +1061,10 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                 input_json_path=input_json_path,
                 base_path=None,
             )
-            tokenizers_info_cfg = set_field(
-                tokenizers_info_cfg=tokenizers_info_cfg,
-                name=t_type,
-                key="modular_json_path",
-                val=config_out_path,
-            )
+            tokenizers_info_cfg_by_name[t_type]["modular_json_path"] = config_out_path
             # Original json path (for the json of the tokenizer used to create the original instance of this ModularTokenizer) is no longer relevant,
             # since it may be located on another machine. config_out_path is used instead.
-            tokenizers_info_cfg = set_field(
-                tokenizers_info_cfg=tokenizers_info_cfg,
-                name=t_type,
-                key="json_path",
-                val=config_out_path,
-            )
+            tokenizers_info_cfg_by_name[t_type]["json_path"] = config_out_path
             tokenizer_inst.save(write_out_path)
         tokenizer_config_overall = {
             "tokenizers_info": tokenizers_info_cfg,
@@ -803,18 +1127,34 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         assert isinstance(data_str, str)
         assert isinstance(input_type, str)
 
-        if input_type not in self.tokenizers_info:
+        info = self.tokenizers_info.get(input_type)
+        if info is None:
             raise Exception(f"Input type {input_type} not found")
 
-        encoded = self.tokenizers_info[input_type]["tokenizer_inst"].encode(data_str)
+        encoded = info.tokenizer_inst.encode(data_str)
+        return self._postprocess_single_type(
+            encoded=encoded,
+            data_str=data_str,
+            input_type=input_type,
+            sequence_id=sequence_id,
+        )
 
+    def _postprocess_single_type(
+        self,
+        encoded: Encoding,
+        data_str: str,
+        input_type: str,
+        sequence_id: Optional[int] = None,
+    ) -> Encoding:
+        """Warns about truncation, and sets the sequence id of an encoding of data_str by the tokenizer of input_type (see _encode_single_type())"""
+        info = self.tokenizers_info[input_type]
         if len(encoded.overflowing) > 0:
             print(
-                f"Warning: FastTokenizer had to truncate sequence. Original Sequence Length = {len(data_str)}, max tokens supported = {self.tokenizers_info[input_type]['max_len']}, exceeded by {len(encoded.overflowing[0].ids)} tokens, for tokenizer: {input_type}"
+                f"Warning: FastTokenizer had to truncate sequence. Original Sequence Length = {len(data_str)}, max tokens supported = {info.max_len}, exceeded by {len(encoded.overflowing[0].ids)} tokens, for tokenizer: {input_type}"
             )
 
         if sequence_id is None:
-            sequence_id = int(self.tokenizers_info[input_type]["tokenizer_id"])
+            sequence_id = int(info.tokenizer_id)
         # set_sequence_id does not always work.
         # Instead of changing the sequence IDS, it sometimes does nothing (probably due to nonunique seq. ids, if we use the same tokenizer for several sequences)
         # In order for this to work, IDs must start with 0 and continue as a sequence of integers.
@@ -823,6 +1163,26 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
 
         return encoded
 
+    def _encode_batch_single_type(
+        self, data_strs: List[str], input_type: str
+    ) -> List[Encoding]:
+        """Encodes several strings with the tokenizer of input_type, in a single call to the underlying tokenizer when possible.
+        The returned encodings are not post-processed (see _postprocess_single_type()).
+        """
+        for data_str in data_strs:
+            assert isinstance(data_str, str)
+        assert isinstance(input_type, str)
+
+        info = self.tokenizers_info.get(input_type)
+        if info is None:
+            raise Exception(f"Input type {input_type} not found")
+
+        tokenizer_inst = info.tokenizer_inst
+        if len(data_strs) == 1 or tokenizer_inst.padding is not None:
+            # a batch would be padded to its longest member, unlike separately encoded strings
+            return [tokenizer_inst.encode(data_str) for data_str in data_strs]
+        return tokenizer_inst.encode_batch(data_strs)
+
     def get_expected_max_len(
         self, override_max_len: Optional[int] = None
     ) -> Optional[int]:
@@ -868,25 +1228,18 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             Encoding: _description_
         """
         encoded_list = []
-        # sequence_ids and sequence_names are an initial implementation of a currently broken huggingface
-        # tokenizer functionality (Encoding.merge() does not preserve all sequence IDs).
-        sequence_ids = []  # sequence id for each token (starting with 1)
-        sequence_types = []  # encoder name used for each token
         curr_sequence_id = 1
+        # each input is encoded separately - for the few, short inputs of a single sample, this is faster than a batch call
+        # to the sub-tokenizer (batching across samples is done by encode_batch())
         for inpt in typed_input_list:
-            input_type = inpt.input_type
-            data_str = inpt.input_string
-            sub_max_len = inpt.max_len
             sub_encoding = self._encode_single_type(
-                data_str=data_str,
-                input_type=input_type,
+                data_str=inpt.input_string,
+                input_type=inpt.input_type,
                 sequence_id=curr_sequence_id,
             )
-            if sub_max_len is not None:
-                sub_encoding.truncate(max_length=sub_max_len)
+            if inpt.max_len is not None:
+                sub_encoding.truncate(max_length=inpt.max_len)
             encoded_list.append(sub_encoding)
-            sequence_ids.extend([curr_sequence_id] * len(sub_encoding))
-            sequence_types.extend([input_type] * len(sub_encoding))
             curr_sequence_id += 1
             # KEEP THIS AS DOC FOR NOW
             # encoded has attributes [ids, type_ids, tokens, offsets, attention_mask, special_tokens_mask, overflowing]
@@ -903,6 +1256,37 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             # overflowing - It's a list of Encoding structures of original content that got clipped out due to max length definition.
             #               In my experience, only the zeroth index contains anything. Don't know when there's more then one member in the list.
 
+        return self._merge_encodings(
+            encoded_list=encoded_list,
+            max_len=max_len,
+            padding_token_id=padding_token_id,
+            padding_token=padding_token,
+            pad_type_id=pad_type_id,
+        )
+
+    def _postprocess_typed_input(
+        self, typed_input: TypedInput, encoded: Encoding, sequence_id: int
+    ) -> Encoding:
+        """Post-processes (see _postprocess_single_type()) the sub-tokenizer encoding of a single TypedInput, and truncates it to its max_len"""
+        encoded = self._postprocess_single_type(
+            encoded=encoded,
+            data_str=typed_input.input_string,
+            input_type=typed_input.input_type,
+            sequence_id=sequence_id,
+        )
+        if typed_input.max_len is not None:
+            encoded.truncate(max_length=typed_input.max_len)
+        return encoded
+
+    def _merge_encodings(
+        self,
+        encoded_list: List[Encoding],
+        max_len: Optional[int],
+        padding_token_id: Optional[int],
+        padding_token: Optional[str],
+        pad_type_id: Optional[int],
+    ) -> Encoding:
+        """Merges the sub-tokenizer encodings of a single input, and truncates/pads the result (see encode_list() for the arguments)"""
         merged_encoding = Encoding.merge(encoded_list)
 
         max_len = self.get_expected_max_len(override_max_len=max_len)
@@ -930,13 +1314,15 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             and padding_token is not None
             and max_len is not None
         ):
-            merged_encoding.pad(
-                length=max_len,
-                direction="right",
-                pad_id=padding_token_id,
-                pad_token=padding_token,
-                pad_type_id=pad_type_id,
-            )
+            # the encoding was already truncated to max_len, so there is nothing to pad if it is at full length
+            if len(merged_encoding) < max_len:
+                merged_encoding.pad(
+                    length=max_len,
+                    direction="right",
+                    pad_id=padding_token_id,
+                    pad_token=padding_token,
+                    pad_type_id=pad_type_id,
+                )
         else:
             if max_len is not None:
                 warn(
@@ -956,20 +1342,46 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             str: _description_
         """
 
+        is_array = hasattr(ids, "__array__")  # e.g. numpy arrays or tensors
+        if not is_array or len(ids) < _DECODE_VECTORIZED_MIN_LEN:
+            # python lists, and short arrays, are faster to decode with a python loop than to convert to numpy
+            if is_array:
+                ids = np.asarray(ids).tolist()
+            id_to_token = self._id_to_token
+            num_ids = len(id_to_token)
+            if skip_special_tokens:
+                id_to_is_special = self._id_to_is_special
+                ret_val = [
+                    id_to_token[id]
+                    for id in ids
+                    if 0 <= id < num_ids
+                    and id_to_token[id] is not None
+                    and not id_to_is_special[id]
+                ]
+            else:
+                ret_val = [
+                    id_to_token[id]
+                    if 0 <= id < num_ids and id_to_token[id] is not None
+                    else f"<@TOKEN_MISSING-{id}>"
+                    for id in ids
+                ]
+            return "".join(ret_val)  # type: ignore
+
+        ids_array = np.asarray(ids, dtype=np.int64)
+        # IDs that are mapped to a token (out of range IDs are not)
+        is_mapped = (ids_array >= 0) & (ids_array < len(self._id_to_token_array))
+        is_mapped[is_mapped] = self._id_is_mapped[ids_array[is_mapped]]
         if skip_special_tokens:
-            ret_val = [
-                self.decoder_dict[id]["token"]
-                for id in ids
-                if id in self.decoder_dict and not self.decoder_dict[id]["is_special"]
+            is_mapped[is_mapped] = ~self._id_to_is_special[ids_array[is_mapped]]
+            return "".join(self._id_to_token_array[ids_array[is_mapped]].tolist())
+        tokens = np.empty(len(ids_array), dtype=object)
+        tokens[is_mapped] = self._id_to_token_array[ids_array[is_mapped]]
+        missing = ~is_mapped
+        if missing.any():
+            tokens[missing] = [
+                f"<@TOKEN_MISSING-{id}>" for id in ids_array[missing].tolist()
             ]
-        else:
-            ret_val = [
-                self.decoder_dict[id]["token"]
-                if id in self.decoder_dict
-                else f"<@TOKEN_MISSING-{id}>"
-                for id in ids
-            ]
-        return "".join(ret_val)
+        return "".join(tokens.tolist())
 
     def encode(
         self,
@@ -996,19 +1408,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         """
         # split sequence to token hints and the following sequence
         # For now support only sub tokenizer type
-        hints_and_subseq = re.split("<@TOKENIZER-TYPE=([^>]*)>", sequence)[
-            1:
-        ]  # the first element is blank - removing it
-        assert (
-            len(hints_and_subseq) > 0 and len(hints_and_subseq) % 2 == 0
-        ), f"Error: expecting leading modular tokenizer hints followed by a sequence to tokenize, got {sequence}"
-        # arrange as a list of TypedInput - each one will include the type and the following sequence
-        encode_list_format = [
-            TypedInput(tokenizer_type, subseq, None)
-            for tokenizer_type, subseq in zip(
-                hints_and_subseq[::2], hints_and_subseq[1::2]
-            )
-        ]
+        encode_list_format = _parse_typed_inputs(sequence)
         return self.encode_list(
             typed_input_list=encode_list_format,
             max_len=max_len,
@@ -1104,19 +1504,19 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
                 special_token_structs (Optional[List]): a list of special token structures to be added to the tokenizer.
 
             Returns:
-                Dict: Returns the updated vocabulary, sorted by value
+                Dict: Returns the updated vocabulary (not sorted by value - the tokenizer serialization orders it by ID when saving)
             """
             if special_token_structs is not None and len(special_token_structs) > 0:
                 special_vocab = {t["content"]: t["id"] for t in special_token_structs}
             else:
                 raise Exception("Got empty special tokens")
             vocab.update(special_vocab)
-            return dict(sorted(vocab.items(), key=lambda x: x[1], reverse=False))
+            return vocab
 
         # remove from tokens all currently existing special_tokens
         special_vocab = self.get_added_vocab()
-        current_special_tokens = set(special_vocab.keys())
-        tokens = list(set(tokens) - current_special_tokens)
+        # tokens is kept as a single set throughout, and converted to a list only when the token structures are built
+        tokens = set(tokens) - special_vocab.keys()
 
         # go over all tokens that already exist as regular tokens, and if such exist and self._max_special_token_id is
         # not set, mark them as special (adding them to special token strictures for all sub-tokenizers), otherwise raise an exception.
@@ -1130,15 +1530,14 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         # tokens <- new tokens, without existing special tokens, and, possibly, without existing regular tokens (depending on the above choice)
 
         # At this point tokens contain to existing special tokens, but may contain regular tokens
-        all_existing_tokens = set([x["token"] for x in self.decoder_dict.values()])
-        tokens_regular = list(set(tokens).intersection(all_existing_tokens))
-        tokens = list(set(tokens) - set(tokens_regular))
+        tokens_regular = tokens & self._token_name_set
+        tokens -= tokens_regular
         # At this point tokens contain no tokens that currently exist in the modular tokenizer, and tokens_regular contain
         # special tokens to be added that are currently regular tokens in the tokenizer
 
         if len(tokens_regular) > 0:
             raise Exception(
-                f"Trying to add to the tokenizer tokens that are currently regular tokens in the tokenizer. Choose other token names. Conflicting tokens are {tokens_regular}"
+                f"Trying to add to the tokenizer tokens that are currently regular tokens in the tokenizer. Choose other token names. Conflicting tokens are {list(tokens_regular)}"
             )
 
         if len(tokens) == 0:
@@ -1147,7 +1546,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         if self._max_special_token_id is not None:
             if len(tokens_regular) > 0:
                 raise Exception(
-                    f"Trying to add to the tokenizer tokens that are currently regular tokens in the tokenizer. Since _max_special_token_id is set, there is no way to uphold it without remapping existing IDs. Conflicting tokens are {tokens_regular}"
+                    f"Trying to add to the tokenizer tokens that are currently regular tokens in the tokenizer. Since _max_special_token_id is set, there is no way to uphold it without remapping existing IDs. Conflicting tokens are {list(tokens_regular)}"
                 )
             max_id = self._max_special_token_id
             next_id: int = max(special_vocab.values()) + 1
@@ -1162,49 +1561,39 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             next_id = self._get_max_mapped_id() + 1
 
         all_special_token_structs = ModularTokenizer.build_special_token_list(
-            special_tokens=tokens, starting_index=next_id
+            special_tokens=list(tokens), starting_index=next_id
         )
 
-        for t_type in self.tokenizers_info:
-            t_info = self.tokenizers_info[t_type]
-            t_json = self.tokenizers_info[t_type]["json_instance"]
+        t_types = list(self.tokenizers_info.keys())
+        for t_type in t_types:
+            t_json = self.tokenizers_info[t_type].json_instance
             # operations on the tokenizer json
-            if "added_tokens" in t_json and t_json["added_tokens"] is not None:
-                t_json["added_tokens"] += all_special_token_structs
+            # the (shared, read-only) token structures are appended in place
+            if t_json.get("added_tokens") is not None:
+                t_json["added_tokens"].extend(all_special_token_structs)
             else:
-                t_json["added_tokens"] = all_special_token_structs
+                t_json["added_tokens"] = list(all_special_token_structs)
 
             t_json["model"]["vocab"] = update_vocab(
                 vocab=t_json["model"]["vocab"],
                 special_token_structs=all_special_token_structs,
             )
             # end operations on json
-            # operations on the tokenizer instance (if possible, operations should be done here, using built-in tokenizer methods)
-            json_str = json.dumps(t_json)
-            tokenizer_inst = Tokenizer.from_str(json_str)
-            if self.special_tokens_dict is not None:
-                # At this point, tokens from self.special_tokens_dict are in every tokenizer. This takes care that the special tokens are added to the tokenizer instance.
-                num_add = tokenizer_inst.add_special_tokens(
-                    list(self.special_tokens_dict.values())
-                )
-                if num_add > 0:
-                    raise Exception(
-                        f"All special tokens should have been in the vocabulary at this point. {num_add} were added - need to check why."
-                    )
-            # restore truncation that was lost when we reset the tokenizer instance
-            if "max_len" in t_info and t_info["max_len"] is not None:
-                max_size = t_info["max_len"]
-                tokenizer_inst.enable_truncation(
-                    max_length=max_size,
-                    direction="right",
-                )
-            json_str = tokenizer_inst.to_str()
-            t_json = json.loads(json_str)
-            self.tokenizers_info[t_type]["tokenizer_inst"] = tokenizer_inst
-            self.tokenizers_info[t_type]["json_instance"] = t_json
+        # rebuild the tokenizer instances (in parallel) from the updated jsons
+        tokenizer_insts = _map_in_threads(
+            lambda t_type: self._build_tokenizer_inst(
+                t_type=t_type,
+                t_json=self.tokenizers_info[t_type].json_instance,
+                special_tokens_values=self._special_tokens_values,
+            ),
+            t_types,
+        )
+        for t_type, tokenizer_inst in zip(t_types, tokenizer_insts):
+            self.tokenizers_info[t_type].tokenizer_inst = tokenizer_inst
 
         # Rebuild inner decoder information
         self.build_inner_decoder()
+        self._token_to_id_cache.clear()
         return len(tokens)
 
     def add_tokens(self, tokens: Union[List, str]) -> int:
@@ -1351,41 +1740,74 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         input: List,
         is_pretokenized: Optional[bool] = False,
         add_special_tokens: Optional[bool] = True,
+        max_len: Optional[int] = None,
+        padding_token_id: Optional[int] = 0,
+        padding_token: Optional[str] = "<PAD>",
+        pad_type_id: Optional[int] = 0,
     ) -> List:
         """
-        Encode the given batch of inputs. This method accept both raw text sequences
-        as well as already pre-tokenized sequences.
-
-        Example:
-            Here are some examples of the inputs that are accepted::
-
-                encode_batch([
-                    "A single sequence",
-                    ("A tuple with a sequence", "And its pair"),
-                    [ "A", "pre", "tokenized", "sequence" ],
-                    ([ "A", "pre", "tokenized", "sequence" ], "And its pair")
-                ])
+        Encode the given batch of inputs. Each input is either a string with modular tokenizer hints (see encode()),
+        or a list of TypedInput (see encode_list()), and the result for each is the same as encoding it separately.
+        The spans of all the inputs are grouped by their tokenizer type, and each sub-tokenizer encodes all of its
+        spans in a single (parallel) call to the underlying tokenizer.
+        The parallelism is controlled by the tokenizers library: the number of threads can be set with the RAYON_NUM_THREADS
+        environment variable, and it is disabled in processes forked after it was used (e.g. dataloader workers), unless
+        TOKENIZERS_PARALLELISM is set. Prefer this over calling encode() in a python loop.
 
         Args:
-            input (A :obj:`List`/:obj:`Tuple` of :obj:`~tokenizers.EncodeInput`):
-                A list of single sequences or pair sequences to encode. Each sequence
-                can be either raw text or pre-tokenized, according to the ``is_pretokenized``
-                argument:
-
-                - If ``is_pretokenized=False``: :class:`~tokenizers.TextEncodeInput`
-                - If ``is_pretokenized=True``: :class:`~tokenizers.PreTokenizedEncodeInput`
-
-            is_pretokenized (:obj:`bool`, defaults to :obj:`False`):
-                Whether the input is already pre-tokenized
-
-            add_special_tokens (:obj:`bool`, defaults to :obj:`True`):
-                Whether to add the special tokens
+            input (:obj:`List`): the inputs to encode
+            is_pretokenized (:obj:`bool`, defaults to :obj:`False`): pre-tokenized inputs are not supported
+            add_special_tokens (:obj:`bool`, defaults to :obj:`True`): setting it to False is not supported
+            max_len (Optional[int], optional): see encode(). Defaults to None.
+            padding_token_id (Optional[int], optional): see encode(). Defaults to 0.
+            padding_token (Optional[str], optional): see encode(). Defaults to "<PAD>".
+            pad_type_id (Optional[int], optional): see encode(). Defaults to 0.
 
         Returns:
             A :obj:`List` of :class:`~tokenizers.Encoding`: The encoded batch
 
         """
-        raise Exception("Not implemented")
+        assert not is_pretokenized, "pretokenized input not implemented"
+        assert add_special_tokens, "add_special_tokens=False not implemented"
+        typed_input_lists = [
+            _parse_typed_inputs(inpt) if isinstance(inpt, str) else list(inpt)
+            for inpt in input
+        ]
+        # (input index, index within input) of the spans of each tokenizer type
+        spans_per_type: Dict[str, List[Tuple[int, int]]] = collections.defaultdict(list)
+        for input_ind, typed_input_list in enumerate(typed_input_lists):
+            for span_ind, typed_input in enumerate(typed_input_list):
+                spans_per_type[typed_input.input_type].append((input_ind, span_ind))
+
+        encoded_lists: List[List[Optional[Encoding]]] = [
+            [None] * len(typed_input_list) for typed_input_list in typed_input_lists
+        ]
+        for input_type, spans in spans_per_type.items():
+            sub_encodings = self._encode_batch_single_type(
+                data_strs=[
+                    typed_input_lists[input_ind][span_ind].input_string
+                    for input_ind, span_ind in spans
+                ],
+                input_type=input_type,
+            )
+            for (input_ind, span_ind), sub_encoding in zip(spans, sub_encodings):
+                # sequence IDs start with 1 within each input, as in encode_list()
+                encoded_lists[input_ind][span_ind] = self._postprocess_typed_input(
+                    typed_input=typed_input_lists[input_ind][span_ind],
+                    encoded=sub_encoding,
+                    sequence_id=span_ind + 1,
+                )
+
+        return [
+            self._merge_encodings(
+                encoded_list=encoded_list,
+                max_len=max_len,
+                padding_token_id=padding_token_id,
+                padding_token=padding_token,
+                pad_type_id=pad_type_id,
+            )
+            for encoded_list in encoded_lists
+        ]
 
     @staticmethod
     def from_buffer(buffer: object) -> object:
@@ -1489,17 +1911,9 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
 
         Note: Irrelevant to ModularTokenizer, since it may not be possible to express with a single vocabulary
         """
-        t_types = self.get_tokenizer_types()
-        assert len(t_types) >= 1
-        t_type = t_types[0]
-        tokenizer_json_inst = self.tokenizers_info[t_type]["json_instance"]
-        special_tokens_list = ModularTokenizer.get_subtokenizer_added_tokens(
-            tokenizer_json_inst=tokenizer_json_inst
-        )
-        special_tokens_dict = ModularTokenizer.get_subtokenizer_vocab(
-            tokenizer_json_inst=tokenizer_json_inst, token_list=special_tokens_list
-        )
-        return special_tokens_dict
+        assert len(self.tokenizers_info) >= 1
+        # computed (from the first sub-tokenizer) by build_inner_decoder(), which runs whenever the vocabulary changes
+        return dict(self._added_vocab)
 
     def get_typed_vocab(self, with_added_tokens: Optional[bool] = True) -> Dict:
         """
@@ -1539,7 +1953,7 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         if not with_added_tokens:
             raise Exception("Not implemented")
         else:
-            return len(list(self.decoder_dict.values()))
+            return self._num_mapped_ids
 
     def _get_max_mapped_id(self, with_added_tokens: Optional[bool] = True) -> int:
         """
@@ -1555,7 +1969,8 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         if not with_added_tokens:
             raise Exception("Not implemented")
         else:
-            return max(list(self.decoder_dict.keys()))
+            # the decoder arrays are sized to fit the highest mapped ID
+            return len(self._id_to_token) - 1
 
     def _get_max_mapped_special_id(
         self, with_added_tokens: Optional[bool] = True
@@ -1573,7 +1988,8 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         if not with_added_tokens:
             raise Exception("Not implemented")
         else:
-            return max(list(self.decoder_dict.keys()))
+            # the decoder arrays are sized to fit the highest mapped ID
+            return len(self._id_to_token) - 1
 
     def get_max_id(self, with_added_tokens: Optional[bool] = True) -> int:
         """
@@ -1601,11 +2017,27 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
         Returns:
             :obj:`Optional[str]`: An optional token, :obj:`None` if out of vocabulary
         """
-        token_info = self.decoder_dict.get(id, None)
-        if token_info is not None:
-            return token_info["token"]
+        if 0 <= id < len(self._id_to_token):
+            return self._id_to_token[id]
         return None
 
+    def id_to_token_batch(self, ids: Iterable) -> List[Optional[str]]:
+        """
+        Convert the given ids to their corresponding tokens - the vectorized equivalent of [self.id_to_token(id) for id in ids]
+
+        Args:
+            ids (:obj:`Iterable`):
+                The ids to convert
+
+        Returns:
+            :obj:`List[Optional[str]]`: A list of tokens, with :obj:`None` for ids that are out of vocabulary
+        """
+        ids_array = np.asarray(ids, dtype=np.int64)
+        in_range = (ids_array >= 0) & (ids_array < len(self._id_to_token_array))
+        tokens = np.full(len(ids_array), None, dtype=object)
+        tokens[in_range] = self._id_to_token_array[ids_array[in_range]]
+        return tokens.tolist()
+
     @property
     def model(self) -> None:
         """
@@ -1729,28 +2161,36 @@ class ModularTokenizer(transformers.PreTrainedTokenizerFast):
             :obj:`Optional[int]`: An optional id, :obj:`None` if out of vocabulary
         """
         if t_type is None:
-            t_type_val = list(self.tokenizers_info.keys())[0]
-            possible_ids = []
-            possible_id_types = []
-            for t_type_val in self.tokenizers_info.keys():
-                tok_id = self.tokenizers_info[t_type_val]["tokenizer_inst"].token_to_id(
-                    token
-                )
-                if tok_id is not None:
-                    possible_ids.append(tok_id)
-                    possible_id_types.append(t_type_val)
-            possible_ids_unique = list(set(possible_ids))
-            if len(possible_ids_unique) == 0:
-                return None
-            elif len(possible_ids_unique) == 1:
-                return possible_ids_unique[0]
-            else:
-                raise Exception(
-                    f"Token {token} maps to several possible ids {possible_ids}, of types {possible_id_types}, and the t_type argument was not set"
-                )
+            cached_id = self._token_to_id_cache.get(token)
+            if cached_id is not None:
+                return cached_id
+            found_id = None
+            for t_info in self.tokenizers_info.values():
+                tok_id = t_info.tokenizer_inst.token_to_id(token)
+                if tok_id is None or tok_id == found_id:
+                    continue
+                if found_id is not None:
+                    # (rare) the sub-tokenizers disagree - collect all the IDs for the error message.
+                    # ambiguous tokens are not cached, so that they keep raising
+                    possible_ids = []
+                    possible_id_types = []
+                    for t_type_val in self.tokenizers_info:
+                        tok_id = self.tokenizers_info[
+                            t_type_val
+                        ].tokenizer_inst.token_to_id(token)
+                        if tok_id is not None:
+                            possible_ids.append(tok_id)
+                            possible_id_types.append(t_type_val)
+                    raise Exception(
+                        f"Token {token} maps to several possible ids {possible_ids}, of types {possible_id_types}, and the t_type argument was not set"
+                    )
+                found_id = tok_id
+            if found_id is not None:
+                self._token_to_id_cache[token] = found_id
+            return found_id
         else:
             t_type_val = str(t_type)
-            return self.tokenizers_info[t_type_val]["tokenizer_inst"].token_to_id(token)
+            return self.tokenizers_info[t_type_val].tokenizer_inst.token_to_id(token)
 
     def train(
         self, files: List, trainer: Optional[tokenizers.trainers.Trainer] = None
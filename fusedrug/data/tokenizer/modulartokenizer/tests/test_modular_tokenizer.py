@@ -0,0 +1,149 @@
+import unittest
+import os
+import copy
+import numpy as np
+from fusedrug.data.tokenizer.modulartokenizer.modular_tokenizer import (
+    ModularTokenizer,
+    SubTokenizerInfo,
+    TypedInput,
+)
+from fusedrug.data.tokenizer.modulartokenizer.special_tokens import (
+    get_special_tokens_dict,
+)
+
+PRETRAINED_TOKENIZERS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    "pretrained_tokenizers",
+)
+
+
+def get_tokenizers_info() -> list:
+    return [
+        {
+            "name": "AA",
+            "tokenizer_id": 0,
+            "json_path": os.path.join(
+                PRETRAINED_TOKENIZERS_DIR, "t5_tokenizer_AA_special.json"
+            ),
+            "modular_json_path": "AA.json",
+            "max_len": 20,
+        },
+        {
+            "name": "SMILES",
+            "tokenizer_id": 1,
+            "json_path": os.path.join(
+                PRETRAINED_TOKENIZERS_DIR,
+                "bpe_tokenizer_trained_on_chembl_zinc_with_aug_4272372_samples_balanced_1_1.json",
+            ),
+            "modular_json_path": "SMILES.json",
+        },
+    ]
+
+
+class TestModularTokenizer(unittest.TestCase):
+    def test_raw_cfg_is_independent(self) -> None:
+        tokenizers_info = get_tokenizers_info()
+        tokenizer = ModularTokenizer(
+            tokenizers_info=tokenizers_info,
+            special_tokens_dict=get_special_tokens_dict(),
+        )
+        self.assertEqual(tokenizer.tokenizers_info_raw_cfg, get_tokenizers_info())
+
+        # mutating the input or the (parsed) tokenizers_info should not affect the raw config
+        tokenizers_info[0]["max_len"] = 7
+        tokenizer.tokenizers_info["SMILES"]["max_len"] = 9
+        self.assertEqual(tokenizer.tokenizers_info_raw_cfg, get_tokenizers_info())
+
+    def test_encode_batch_matches_encode(self) -> None:
+        tokenizer = ModularTokenizer(
+            tokenizers_info=get_tokenizers_info(),
+            special_tokens_dict=get_special_tokens_dict(),
+        )
+        inputs = [
+            "<@TOKENIZER-TYPE=AA>ACDEFG<@TOKENIZER-TYPE=SMILES>CC(=O)OC1=CC=CC=C1C(=O)O<EOS>",
+            "<@TOKENIZER-TYPE=SMILES>CCO<@TOKENIZER-TYPE=AA>ACD<@TOKENIZER-TYPE=AA>EF<EOS>",
+            [TypedInput("AA", "ACDE", 2), TypedInput("SMILES", "CCCC", None)],
+        ]
+        for max_len in [None, 12, 40]:
+            batch_encodings = tokenizer.encode_batch(inputs, max_len=max_len)
+            for inpt, batch_encoding in zip(inputs, batch_encodings):
+                if isinstance(inpt, str):
+                    encoding = tokenizer.encode(inpt, max_len=max_len)
+                else:
+                    encoding = tokenizer.encode_list(
+                        inpt, max_len=max_len, padding_token_id=0, pad_type_id=0
+                    )
+                self.assertEqual(batch_encoding.ids, encoding.ids)
+                self.assertEqual(batch_encoding.type_ids, encoding.type_ids)
+                self.assertEqual(batch_encoding.attention_mask, encoding.attention_mask)
+                self.assertEqual(batch_encoding.sequence_ids, encoding.sequence_ids)
+
+    def test_id_to_token_batch_matches_id_to_token(self) -> None:
+        tokenizer = ModularTokenizer(
+            tokenizers_info=get_tokenizers_info(),
+            special_tokens_dict=get_special_tokens_dict(),
+        )
+        ids = [-1, 0, 1, 5, 100, 600, 3000, 99999]
+        self.assertEqual(
+            tokenizer.id_to_token_batch(ids),
+            [tokenizer.id_to_token(i) for i in ids],
+        )
+
+    def test_decode(self) -> None:
+        tokenizer = ModularTokenizer(
+            tokenizers_info=get_tokenizers_info(),
+            special_tokens_dict=get_special_tokens_dict(),
+        )
+        pad_id = tokenizer.token_to_id("<PAD>")
+        c_id = tokenizer.token_to_id("C", t_type="SMILES")
+        # short and long (vectorized for arrays) inputs, as lists and as arrays
+        for num_repeats in [1, 200]:
+            ids = [c_id, pad_id, 99999, -1] * num_repeats
+            for inpt in [ids, np.array(ids)]:
+                self.assertEqual(
+                    tokenizer.decode(inpt),
+                    "C<PAD><@TOKEN_MISSING-99999><@TOKEN_MISSING--1>" * num_repeats,
+                )
+                self.assertEqual(
+                    tokenizer.decode(inpt, skip_special_tokens=True),
+                    "C" * num_repeats,
+                )
+
+    def test_update_id2token_mapping_first_wins(self) -> None:
+        id2token = {1: {"token": "a", "is_special": False}}
+        id2token = ModularTokenizer.update_id2token_mapping(
+            id2token, {"b": 1, "c": 2, "d": 2}, is_special=True
+        )
+        self.assertEqual(
+            id2token,
+            {
+                1: {"token": "a", "is_special": False},
+                2: {"token": "c", "is_special": True},
+            },
+        )
+
+    def test_sub_tokenizer_info_contains(self) -> None:
+        t_info = SubTokenizerInfo.from_dict(
+            {"name": "AA", "max_len": None, "json_path": "AA.json", "extra_key": None}
+        )
+        # a key is "in" t_info once it was set, whatever its value - for both fields and extra keys
+        for key in ["name", "max_len", "json_path", "extra_key"]:
+            self.assertIn(key, t_info)
+        for key in ["modular_json_path", "tokenizer_inst", "other_key"]:
+            self.assertNotIn(key, t_info)
+        self.assertIsNone(t_info.get("max_len", 5))
+        self.assertEqual(t_info.get("modular_json_path", 5), 5)
+
+        t_info.modular_json_path = None
+        t_info["other_key"] = None
+        self.assertIn("modular_json_path", t_info)
+        self.assertIn("other_key", t_info)
+
+        t_info_copy = copy.copy(t_info)
+        t_info_copy["tokenizer_inst"] = None
+        self.assertIn("tokenizer_inst", t_info_copy)
+        self.assertNotIn("tokenizer_inst", t_info)
+
+
+if __name__ == "__main__":
+    unittest.main()
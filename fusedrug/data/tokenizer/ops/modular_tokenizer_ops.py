@@ -1,14 +1,16 @@
 from fuse.utils import NDict
 from fuse.data import OpBase, get_sample_id
-from fusedrug.data.tokenizer.modulartokenizer.modular_tokenizer import (
-    ModularTokenizer as Tokenizer,
-)
+from tokenizers import Encoding
 from warnings import warn
-from collections import defaultdict
-from typing import Tuple, Optional, Union, Any
+from collections import OrderedDict
+from typing import Tuple, Optional, Union, Any, List
+import numpy as np
 import os
 import re
 
+# the default regex get_min_max_sentinels() uses to find the number in a sentinel name
+_DEFAULT_INTEGER_FIND_REGEX = r"\d{1,}"
+
 
 class FastModularTokenizer(OpBase):
     """
@@ -23,6 +25,7 @@ class FastModularTokenizer(OpBase):
         pad_type_id: Union[int, None] = None,
         validate_ends_with_eos: Optional[str] = "<EOS>",
         verbose: Optional[bool] = False,
+        cache_size: int = 0,
         **kwargs: Any,
     ) -> None:
         """
@@ -35,6 +38,8 @@ class FastModularTokenizer(OpBase):
             validate_ends_with_eos: during encoder request (a _call_ to the op) will make sure that it ends with the provided eos token, and raise exception otherwise.
                 having an eos (end of sentence) token in the end is useful for multiple scenarios, for example in a generative transformer (like T5 encoder-decoder)
             verbose:
+            cache_size: if > 0, the encodings of up to this many of the most recently encoded string inputs are cached (keyed on the string and max_seq_len),
+                so repeated inputs (e.g. the same molecule in many samples) are not re-tokenized. Not used when the tokenized object is requested.
         """
         super().__init__(**kwargs)
 
@@ -43,6 +48,11 @@ class FastModularTokenizer(OpBase):
                 f"DEBUG:FastModularTokenizer __init__ called for path {tokenizer_path}"
             )
 
+        # imported here since it pulls in transformers, which is slow to import and not needed by the other ops in this package
+        from fusedrug.data.tokenizer.modulartokenizer.modular_tokenizer import (
+            ModularTokenizer as Tokenizer,
+        )
+
         self._tokenizer_path = tokenizer_path
         self._tokenizer = Tokenizer.from_file(self._tokenizer_path)
         pad_id = self._tokenizer.token_to_id(pad_token)
@@ -60,9 +70,13 @@ class FastModularTokenizer(OpBase):
                 raise Exception(
                     f"Could not find eos token = {validate_ends_with_eos} in {tokenizer_path}. You can disable the validation by setting validate_ends_with_eos=None"
                 )
+            # the eos validation only looks at this many chars at the end of the input (see _get_input())
+            self._eos_tail_len = len(self._validate_ends_with_eos) + 32
 
         self._pad_id = pad_id
         self._verbose = verbose
+        # the "no output keys" warning is only issued once per op instance
+        self._warned_no_output = False
 
         if max_size is not None:
             assert isinstance(max_size, int)
@@ -83,8 +97,13 @@ class FastModularTokenizer(OpBase):
 
         self._max_size = max_size
 
+        # (string input, max_seq_len) -> Encoding, in least to most recently used order (see _encode_str_cached())
+        self._cache_size = cache_size
+        self._encode_cache: OrderedDict = OrderedDict()
+
         if self._verbose:
-            self._debug_max_tokenized_len_encountered = defaultdict(int)
+            # the max encoded (unpadded) length encountered so far
+            self._debug_max_tokenized_len_encountered = 0
 
     def get_vocab_size(self) -> int:
         return self._tokenizer.get_vocab_size()
@@ -108,8 +127,8 @@ class FastModularTokenizer(OpBase):
 
     def get_min_max_sentinels(
         self,
-        sentinel_prefix: Optional[str] = "<SENTINEL_ID",
-        integer_find_regex: Optional[str] = "\d{1,}",
+        sentinel_prefix: str = "<SENTINEL_ID",
+        integer_find_regex: str = _DEFAULT_INTEGER_FIND_REGEX,
     ) -> Tuple[int, int]:
         """
         returns a Tuple [min encountered sentinel name, max encountered sentinel name]
@@ -124,16 +143,28 @@ class FastModularTokenizer(OpBase):
         """
         min_token = None
         max_token = None
+        # compiled once for the whole scan
+        integer_find_pattern = re.compile(integer_find_regex)
+        # a custom regex may parse the sentinel names differently, so it is always used when given
+        use_fast_path = integer_find_regex == _DEFAULT_INTEGER_FIND_REGEX
 
-        for k, _ in self._tokenizer.get_added_vocab().items():
+        for k in self._tokenizer.get_added_vocab():
             if sentinel_prefix in k:
-                val = re.findall(integer_find_regex, k)
-                if len(val) != 1:
-                    raise Exception(
-                        f"expected exactly one integer number in {k} but found {val}"
-                    )
-                val = val[0]
-                val = int(val)
+                # fast path for the common <SENTINEL_ID_NNN> format - the number is all that is left after the prefix
+                suffix = (
+                    k[len(sentinel_prefix) :].strip("_>")
+                    if use_fast_path and k.startswith(sentinel_prefix)
+                    else ""
+                )
+                if suffix.isdecimal():
+                    val = int(suffix)
+                else:
+                    found = integer_find_pattern.findall(k)
+                    if len(found) != 1:
+                        raise Exception(
+                            f"expected exactly one integer number in {k} but found {found}"
+                        )
+                    val = int(found[0])
 
                 if (min_token is None) or (val < min_token):
                     min_token = val
@@ -169,6 +200,19 @@ class FastModularTokenizer(OpBase):
         """
         return self._tokenizer.get_expected_max_len(override_max_len=override_max_len)
 
+    def _encode_str_cached(self, data: str, max_seq_len: Optional[int]) -> Encoding:
+        """Encodes a string input, reusing the encoding of a recent identical input (the returned Encoding is shared, so it must not be modified)"""
+        key = (data, max_seq_len)
+        encoded = self._encode_cache.get(key)
+        if encoded is not None:
+            self._encode_cache.move_to_end(key)
+            return encoded
+        encoded = self._tokenizer.encode(data, max_len=max_seq_len)
+        self._encode_cache[key] = encoded
+        if len(self._encode_cache) > self._cache_size:
+            self._encode_cache.popitem(last=False)
+        return encoded
+
     def __call__(
         self,
         sample_dict: NDict,
@@ -178,6 +222,7 @@ class FastModularTokenizer(OpBase):
         key_out_attention_mask: Optional[str] = None,
         convert_attention_mask_to_bool: Optional[bool] = True,
         max_seq_len: Optional[int] = None,
+        attention_mask_as_numpy: bool = False,
     ) -> NDict:
         """
         :param key_in: key to either a:
@@ -186,56 +231,160 @@ class FastModularTokenizer(OpBase):
             (2) list of modular_tokenizer.TypedInput specifying the tokenizer type and the subsequence to tokenize
 
         :param max_seq_len: set maximum sequence len dynamically, used for both padding and truncation.
+        :param attention_mask_as_numpy: store the attention mask as a numpy array (of dtype bool if convert_attention_mask_to_bool, uint8 otherwise)
+            instead of a python list. It takes 1 byte per element (instead of a pointer to a python object) and can be converted to a tensor without a copy.
         """
 
+        data = self._get_input(sample_dict, key_in)
+
+        if (
+            (key_out_tokens_ids is None)
+            and (key_out_tokenized_object is None)
+            and (key_out_attention_mask is None)
+        ):
+            # nothing to store, so there is no need to encode (the input is still validated above)
+            self._warn_no_output()
+            return sample_dict
+
+        if isinstance(data, str):
+            # the tokenized object is handed out to the sample, so it must not be shared with the cache
+            if self._cache_size > 0 and key_out_tokenized_object is None:
+                encoded = self._encode_str_cached(data, max_seq_len)
+            else:
+                encoded = self._tokenizer.encode(data, max_len=max_seq_len)
+        else:
+            encoded = self._tokenizer.encode_list(data, max_len=max_seq_len)
+
+        return self._set_outputs(
+            sample_dict=sample_dict,
+            data=data,
+            encoded=encoded,
+            key_out_tokenized_object=key_out_tokenized_object,
+            key_out_tokens_ids=key_out_tokens_ids,
+            key_out_attention_mask=key_out_attention_mask,
+            convert_attention_mask_to_bool=convert_attention_mask_to_bool,
+            max_seq_len=max_seq_len,
+            attention_mask_as_numpy=attention_mask_as_numpy,
+        )
+
+    def call_batch(
+        self,
+        sample_dicts: List[NDict],
+        key_in: str,
+        key_out_tokenized_object: Optional[str] = None,
+        key_out_tokens_ids: Optional[str] = None,
+        key_out_attention_mask: Optional[str] = None,
+        convert_attention_mask_to_bool: Optional[bool] = True,
+        max_seq_len: Optional[int] = None,
+        attention_mask_as_numpy: bool = False,
+    ) -> List[NDict]:
+        """
+        Same as calling the op on each of sample_dicts (see __call__() for the arguments), but the inputs of all the samples are
+        encoded together (see ModularTokenizer.encode_batch()), so each sub-tokenizer is called once for the whole batch, in parallel.
+        """
+        datas = [self._get_input(sample_dict, key_in) for sample_dict in sample_dicts]
+        if (
+            (key_out_tokens_ids is None)
+            and (key_out_tokenized_object is None)
+            and (key_out_attention_mask is None)
+        ):
+            self._warn_no_output()
+            return sample_dicts
+        encodings: List[Optional[Encoding]] = [None] * len(datas)
+        # string and TypedInput list inputs are encoded separately, since encode() and encode_list() have different padding defaults
+        str_inds = [i for i, data in enumerate(datas) if isinstance(data, str)]
+        list_inds = [i for i, data in enumerate(datas) if not isinstance(data, str)]
+        for inds, padding_kwargs in (
+            (str_inds, {}),
+            (list_inds, dict(padding_token_id=None, pad_type_id=None)),
+        ):
+            if len(inds) == 0:
+                continue
+            batch_encodings = self._tokenizer.encode_batch(
+                [datas[i] for i in inds], max_len=max_seq_len, **padding_kwargs
+            )
+            for i, encoded in zip(inds, batch_encodings):
+                encodings[i] = encoded
+
+        return [
+            self._set_outputs(
+                sample_dict=sample_dict,
+                data=data,
+                encoded=encoded,
+                key_out_tokenized_object=key_out_tokenized_object,
+                key_out_tokens_ids=key_out_tokens_ids,
+                key_out_attention_mask=key_out_attention_mask,
+                convert_attention_mask_to_bool=convert_attention_mask_to_bool,
+                max_seq_len=max_seq_len,
+                attention_mask_as_numpy=attention_mask_as_numpy,
+            )
+            for sample_dict, data, encoded in zip(sample_dicts, datas, encodings)
+        ]
+
+    def _get_input(self, sample_dict: NDict, key_in: str) -> Union[str, list]:
+        """Returns the (validated) input to encode, stored in sample_dict[key_in]"""
         data = sample_dict[key_in]
-        if not isinstance(data, (list, str)):
+        validate_eos = self._validate_ends_with_eos is not None
+        # strings are the common case, so they are checked first
+        if isinstance(data, str):
+            last_seq = data
+        elif isinstance(data, list):
             # data is a list of named tuples of type collections.namedtuple("TypedInput", ["input_type", "input_string", "max_len"])
+            last_seq = data[-1].input_string if validate_eos else None
+        else:
             raise Exception(
                 f"Expected key_in={key_in} to point to a list of inputs or string with builtin tokenizer hints, and instead got a {type(data)}. value={data}"
             )
 
-        if self._validate_ends_with_eos is not None:
-            if isinstance(data, str):
-                last_seq = data
-            else:
-                last_seq = data[-1].input_string
-            if not last_seq.rstrip().endswith(self._validate_ends_with_eos):
+        if validate_eos:
+            # avoid copying (rstrip) the whole, possibly very long, sequence - only its tail is needed
+            tail = last_seq[-self._eos_tail_len :].rstrip()
+            if len(tail) < len(self._validate_ends_with_eos):
+                # the tail is (mostly) whitespace, fall back to stripping the whole sequence
+                tail = last_seq.rstrip()
+            if not tail.endswith(self._validate_ends_with_eos):
                 raise Exception(
                     f"self._validate_ends_with_eos was set to {self._validate_ends_with_eos}, but about to encode a string that does not end with it. The str end was: {last_seq}"
                 )
+        return data
 
-        if isinstance(data, str):
-            encoded = self._tokenizer.encode(data, max_len=max_seq_len)
-        else:
-            encoded = self._tokenizer.encode_list(data, max_len=max_seq_len)
-
+    def _set_outputs(
+        self,
+        sample_dict: NDict,
+        data: Union[str, list],
+        encoded: Encoding,
+        key_out_tokenized_object: Optional[str],
+        key_out_tokens_ids: Optional[str],
+        key_out_attention_mask: Optional[str],
+        convert_attention_mask_to_bool: Optional[bool],
+        max_seq_len: Optional[int],
+        attention_mask_as_numpy: bool,
+    ) -> NDict:
+        """Validates the encoding of data, and stores the requested outputs in sample_dict (see __call__() for the arguments)"""
         expected_max_len = self.get_max_len(override_max_len=max_seq_len)
         if (
             expected_max_len is not None
         ):  # we tightly couple padding length and max size.
-            assert expected_max_len == len(encoded.ids)
+            # len(encoded) is the number of tokens, without building the ids list like len(encoded.ids) would
+            assert expected_max_len == len(encoded)
 
         if self._verbose:
-            if self._pad_id in encoded.ids:
-                _encoded_len_unpadded = encoded.ids.index(self._pad_id)
-            else:
+            # a single scan over the ids (each access to encoded.ids also builds a new list)
+            encoded_ids = encoded.ids
+            try:
+                _encoded_len_unpadded = encoded_ids.index(self._pad_id)
+            except ValueError:
                 # no padding, therefore it was fully used (either exactly the size, or most likely it was clipped)
-                _encoded_len_unpadded = len(encoded.ids)
+                _encoded_len_unpadded = len(encoded_ids)
 
-            if (
-                _encoded_len_unpadded
-                > self._debug_max_tokenized_len_encountered[self._tokenizer_path]
-            ):
+            if _encoded_len_unpadded > self._debug_max_tokenized_len_encountered:
                 print(
                     "DEBUG: FastModularTokenizer: encountered new max encoded size:",
                     _encoded_len_unpadded,
                     " for tokenizer: ",
                     self._tokenizer_path,
                 )
-                self._debug_max_tokenized_len_encountered[
-                    self._tokenizer_path
-                ] = _encoded_len_unpadded
+                self._debug_max_tokenized_len_encountered = _encoded_len_unpadded
 
         # KEEP THIS AS DOC FOR NOW
         # encoded has attributes [ids, type_ids, tokens, offsets, attention_mask, special_tokens_mask, overflowing]
@@ -253,12 +402,11 @@ class FastModularTokenizer(OpBase):
             if isinstance(data, str):
                 overall_char_len = len(data)
             else:
-                overall_char_len = sum([len(x.input_string) for x in data])
+                overall_char_len = sum(len(x.input_string) for x in data)
 
-            max_len = self.get_max_len(override_max_len=max_seq_len)
             print(
                 f"Warning: FastModularTokenizer (pid={os.getpid()}) had to truncate sequence. Original Sequence Length = {overall_char_len} \
-                    max supported = {max_len} {'possibly due to per-subtokenizer upper limits set in the input list' if max_len is None else ''} \
+                    max supported = {expected_max_len} {'possibly due to per-subtokenizer upper limits set in the input list' if expected_max_len is None else ''} \
                     for tokenizer: {self._tokenizer_path} for sample_id {get_sample_id(sample_dict)}"
             )
 
@@ -270,15 +418,27 @@ class FastModularTokenizer(OpBase):
             sample_dict[key_out_tokens_ids] = encoded.ids
 
         if key_out_attention_mask is not None:
-            sample_dict[key_out_attention_mask] = encoded.attention_mask
-            if convert_attention_mask_to_bool:
-                sample_dict[key_out_attention_mask] = [
-                    bool(x) for x in sample_dict[key_out_attention_mask]
-                ]
+            if attention_mask_as_numpy:
+                # the mask values are 0/1, so they can be packed directly into bytes (a bytearray, so the array is writable)
+                sample_dict[key_out_attention_mask] = np.frombuffer(
+                    bytearray(encoded.attention_mask),
+                    dtype=np.bool_ if convert_attention_mask_to_bool else np.uint8,
+                )
+            elif convert_attention_mask_to_bool:
+                sample_dict[key_out_attention_mask] = list(
+                    map(bool, encoded.attention_mask)
+                )
+            else:
+                sample_dict[key_out_attention_mask] = encoded.attention_mask
 
         if (key_out_tokens_ids is None) and (key_out_tokenized_object is None):
+            self._warn_no_output()
+
+        return sample_dict
+
+    def _warn_no_output(self) -> None:
+        if not self._warned_no_output:
+            self._warned_no_output = True
             warn(
                 "FastModularTokenizer Op got key_out_tokens_ids=None and key_out_tokenized_object=None, which means it will not modify anything in the sample. Is this intended?"
             )
-
-        return sample_dict
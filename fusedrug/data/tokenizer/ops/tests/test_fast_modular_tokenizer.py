@@ -0,0 +1,131 @@
+import unittest
+import os
+import numpy as np
+from typing import Any, List, Union
+from fuse.utils import NDict
+from fusedrug.data.tokenizer.ops import FastModularTokenizer
+from fusedrug.data.tokenizer.modulartokenizer.modular_tokenizer import TypedInput
+
+PRETRAINED_TOKENIZER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    "modulartokenizer",
+    "pretrained_tokenizers",
+    "modular_AA_SMILES_single_path",
+)
+
+
+def get_tokenizer_op(**kwargs: Any) -> FastModularTokenizer:
+    return FastModularTokenizer(
+        tokenizer_path=PRETRAINED_TOKENIZER_PATH,
+        max_size=30,
+        pad_token="<PAD>",
+        **kwargs,
+    )
+
+
+def get_inputs() -> List[Union[str, List[TypedInput]]]:
+    return [
+        "<@TOKENIZER-TYPE=AA>ACDEFG<@TOKENIZER-TYPE=SMILES>CC(=O)OC1=CC=CC=C1C(=O)O<EOS>",
+        [
+            TypedInput("AA", "<BINDING>ACDEFGHIKLMNPQRS", 10),
+            TypedInput("SMILES", "CCCO<EOS>", None),
+        ],
+        "<@TOKENIZER-TYPE=SMILES>CCO<@TOKENIZER-TYPE=AA>ACD<EOS>",
+    ]
+
+
+def get_sample(data: Union[str, List[TypedInput]]) -> NDict:
+    return NDict({"data.query": data, "data.sample_id": 1})
+
+
+class TestFastModularTokenizer(unittest.TestCase):
+    def test_get_min_max_sentinels(self) -> None:
+        tokenizer_op = get_tokenizer_op()
+        self.assertEqual(tokenizer_op.get_min_max_sentinels(), (0, 199))
+        # a non-default regex is always used, instead of the fast path for <SENTINEL_ID_NNN> names
+        self.assertEqual(
+            tokenizer_op.get_min_max_sentinels(integer_find_regex="[0-9]+"), (0, 199)
+        )
+        with self.assertRaises(Exception):
+            # finds several (single digit) numbers in <SENTINEL_ID_10>
+            tokenizer_op.get_min_max_sentinels(integer_find_regex="[0-9]")
+
+        # a sentinel that doesn't follow the <SENTINEL_ID_NNN> format is parsed with the regex
+        tokenizer_op._tokenizer.add_special_tokens(["<SENTINEL_ID_x1000>"])
+        self.assertEqual(tokenizer_op.get_min_max_sentinels(), (0, 1000))
+        self.assertEqual(
+            tokenizer_op.get_min_max_sentinels(integer_find_regex="[0-9]+"), (0, 1000)
+        )
+
+    def test_call_batch_matches_call(self) -> None:
+        tokenizer_op = get_tokenizer_op()
+        for max_seq_len in [None, 12]:
+            out_keys = dict(
+                key_in="data.query",
+                key_out_tokenized_object="data.tokenized",
+                key_out_tokens_ids="data.ids",
+                key_out_attention_mask="data.mask",
+                max_seq_len=max_seq_len,
+            )
+            batch_samples = tokenizer_op.call_batch(
+                [get_sample(data) for data in get_inputs()], **out_keys
+            )
+            for data, batch_sample in zip(get_inputs(), batch_samples):
+                sample = tokenizer_op(get_sample(data), **out_keys)
+                self.assertEqual(batch_sample["data.ids"], sample["data.ids"])
+                self.assertEqual(batch_sample["data.mask"], sample["data.mask"])
+                self.assertEqual(
+                    batch_sample["data.tokenized"].type_ids,
+                    sample["data.tokenized"].type_ids,
+                )
+
+    def test_cache_matches_no_cache(self) -> None:
+        tokenizer_op = get_tokenizer_op()
+        cached_tokenizer_op = get_tokenizer_op(cache_size=2)
+        # repeated inputs, more distinct inputs than the cache size, and a max_seq_len that is part of the cache key
+        for data in get_inputs() * 2:
+            for max_seq_len in [None, 12]:
+                out_keys = dict(
+                    key_in="data.query",
+                    key_out_tokens_ids="data.ids",
+                    key_out_attention_mask="data.mask",
+                    max_seq_len=max_seq_len,
+                )
+                cached_sample = cached_tokenizer_op(get_sample(data), **out_keys)
+                sample = tokenizer_op(get_sample(data), **out_keys)
+                self.assertEqual(cached_sample["data.ids"], sample["data.ids"])
+                self.assertEqual(cached_sample["data.mask"], sample["data.mask"])
+        self.assertLessEqual(len(cached_tokenizer_op._encode_cache), 2)
+
+    def test_attention_mask_as_numpy(self) -> None:
+        tokenizer_op = get_tokenizer_op()
+        for convert_attention_mask_to_bool, dtype in [(True, bool), (False, np.uint8)]:
+            out_keys = dict(
+                key_in="data.query",
+                key_out_tokens_ids="data.ids",
+                key_out_attention_mask="data.mask",
+                convert_attention_mask_to_bool=convert_attention_mask_to_bool,
+            )
+            for data in get_inputs():
+                mask = tokenizer_op(
+                    get_sample(data), attention_mask_as_numpy=True, **out_keys
+                )["data.mask"]
+                expected_mask = tokenizer_op(get_sample(data), **out_keys)["data.mask"]
+                self.assertEqual(mask.dtype, dtype)
+                self.assertTrue(mask.flags.writeable)
+                self.assertEqual(mask.tolist(), list(expected_mask))
+            batch_masks = [
+                sample["data.mask"]
+                for sample in tokenizer_op.call_batch(
+                    [get_sample(data) for data in get_inputs()],
+                    attention_mask_as_numpy=True,
+                    **out_keys,
+                )
+            ]
+            for data, batch_mask in zip(get_inputs(), batch_masks):
+                expected_mask = tokenizer_op(get_sample(data), **out_keys)["data.mask"]
+                self.assertEqual(batch_mask.tolist(), list(expected_mask))
+
+
+if __name__ == "__main__":
+    unittest.main()